@@ -0,0 +1,85 @@
+"""
+Benchmarks of the food counts on synthetic GNPS molecular networks of several sizes.
+"""
+
+import gfop.get_food_counts as gfop
+from gfop.synthetic import make_gnps_network
+
+# Number of clusters, study files and reference files of each network size.
+SCALES = {
+    "small": (1_000, 50, 200),
+    "medium": (10_000, 200, 1_000),
+    "large": (100_000, 1_000, 3_000),
+}
+
+
+def setup_cache():
+    """
+    Generate the synthetic networks once for all benchmarks.
+    """
+    paths = {}
+    for scale, (n_clusters, n_study_files, n_reference_files) in SCALES.items():
+        paths[scale] = f"network_{scale}.tsv"
+        make_gnps_network(
+            n_clusters,
+            n_study_files,
+            n_reference_files,
+            study_groups=["G1", "G2"],
+            water_fraction=0.005,
+        ).to_csv(paths[scale], sep="\t", index=False)
+    return paths
+
+
+class DatasetFoodCounts:
+    params = list(SCALES)
+    param_names = ["scale"]
+    timeout = 600
+
+    def setup(self, paths, scale):
+        # Measure the counting, not the first read of the food ontology.
+        gfop.get_sample_types("all")
+
+    def time_get_dataset_food_counts(self, paths, scale):
+        gfop.get_dataset_food_counts(paths[scale], "all", ["G1"], ["G4"], 3)
+
+    def time_get_dataset_food_counts_level0(self, paths, scale):
+        gfop.get_dataset_food_counts(paths[scale], "all", ["G1"], ["G4"], 0)
+
+    def time_get_dataset_food_counts_all(self, paths, scale):
+        gfop.get_dataset_food_counts_all(paths[scale], "all", ["G1"], ["G4"])
+
+    def time_get_dataset_food_counts_all_sparse(self, paths, scale):
+        gfop.get_dataset_food_counts_all(
+            paths[scale], "all", ["G1"], ["G4"], include_zeros=False
+        )
+
+    def peakmem_get_dataset_food_counts_all(self, paths, scale):
+        gfop.get_dataset_food_counts_all(paths[scale], "all", ["G1"], ["G4"])
+
+
+class FileFoodCounts:
+    params = (list(SCALES), [False, True])
+    param_names = ["scale", "network_index"]
+    timeout = 600
+
+    def setup(self, paths, scale, network_index):
+        self.gnps_network = gfop.read_gnps_network(paths[scale])
+        self.sample_types = gfop.get_sample_types("all")
+        self.network_index = (
+            gfop.NetworkIndex(self.gnps_network) if network_index else None
+        )
+        self.filenames = gfop.get_sample_metadata(self.gnps_network, ["G1"])[
+            "filename"
+        ][:10]
+
+    def time_get_file_food_counts(self, paths, scale, network_index):
+        for filename in self.filenames:
+            gfop.get_file_food_counts(
+                self.gnps_network,
+                self.sample_types,
+                ["G1"],
+                ["G4"],
+                filename,
+                3,
+                self.network_index,
+            )
@@ -0,0 +1,36 @@
+"""
+Benchmarks of the start up time of gfop, run in a fresh interpreter each time.
+The command line must not load numpy, pandas or scipy before they are used.
+"""
+
+import subprocess
+import sys
+
+
+class ImportTime:
+    def timeraw_import_get_food_counts(self):
+        return "import gfop.get_food_counts"
+
+    def timeraw_import_cli(self):
+        return "import gfop.cli"
+
+    def timeraw_cli_help(self):
+        return """
+        import gfop.cli
+        try:
+            gfop.cli.main(["--help"])
+        except SystemExit:
+            pass
+        """
+
+    def track_heavy_modules_loaded(self):
+        code = (
+            "import sys, gfop.cli\n"
+            "print(sum(name in sys.modules for name in ['numpy', 'pandas', 'scipy']))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, check=True, text=True
+        )
+        return int(result.stdout)
+
+    track_heavy_modules_loaded.unit = "modules"
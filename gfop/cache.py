@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Optional
+
+import pandas as pd
+
+
+class ResultCache:
+    """
+    Persistent cache of food counts tables, stored as Parquet files in a directory.
+
+    Results are addressed by a hash of everything they depend on, so a cached result is
+    only returned for the exact same network contents, food ontology and arguments.
+    When the cached results exceed the maximum size, the least recently used ones are
+    evicted. Storing results requires pyarrow or fastparquet.
+
+    Args:
+        directory (string): directory to store the cached results in, created if needed.
+        max_size (integer): maximum total size of the cached results in bytes.
+    Examples:
+        cache = ResultCache('~/.cache/gfop', max_size = 10 * 2**30)
+        get_dataset_food_counts_all(gnps_network = 'METABOLOMICS-SNETS-V2-07f85565-view_all_clusters_withID_beta-main.tsv',
+                                    sample_types = 'simple',
+                                    all_groups = ['G1'],
+                                    some_groups = ['G4'],
+                                    cache = cache)
+    """
+
+    def __init__(self, directory: str, max_size: int = 2**30):
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def get_key(**params) -> str:
+        """
+        Return: the cache key of a result computed with the given JSON-serializable parameters.
+        """
+        params = json.dumps(params, sort_keys=True)
+        return hashlib.sha256(params.encode("utf-8")).hexdigest()
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.parquet")
+
+    def load(self, key: str) -> Optional[pd.DataFrame]:
+        """
+        Return: the cached result with the given key, or None if it is not cached.
+        """
+        path = self._get_path(key)
+        try:
+            result = pd.read_parquet(path)
+            # Mark the result as recently used.
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return result
+
+    def save(self, key: str, result: pd.DataFrame) -> None:
+        """
+        Store a result under the given key and evict the least recently used results
+        if the cache exceeds its maximum size.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            result.to_parquet(temp_path)
+            os.replace(temp_path, self._get_path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self._evict()
+
+    def _evict(self) -> None:
+        """
+        Remove the least recently used results until the cache fits its maximum size.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".parquet"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+    def clear(self) -> None:
+        """
+        Remove all cached results.
+        """
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".parquet"):
+                os.remove(entry.path)
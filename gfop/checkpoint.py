@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import os
+import re
+import tempfile
+from typing import Dict
+
+import pandas as pd
+
+_BATCH_PATTERN = re.compile(r"batch_(\d+)_(\d+)\.parquet")
+
+
+class Checkpoint:
+    """
+    Checkpoint of a long food counts run, stored as one Parquet file per completed batch
+    of study files in a directory.
+
+    Each batch holds the food counts of its study files at all levels, so that a run that is
+    interrupted can resume from the batches that are complete. Batches are written atomically,
+    a batch that was being written when the run stopped is computed again.
+    Storing batches requires pyarrow or fastparquet.
+
+    Args:
+        directory (string): directory to store the batches in, created if needed.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = os.path.expanduser(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _get_path(self, start: int, stop: int) -> str:
+        return os.path.join(self.directory, f"batch_{start:09d}_{stop:09d}.parquet")
+
+    def get_batches(self) -> Dict[int, int]:
+        """
+        Return: the start and stop positions of the study files of the completed batches.
+        """
+        batches = {}
+        for entry in os.scandir(self.directory):
+            match = _BATCH_PATTERN.fullmatch(entry.name)
+            if match is not None:
+                batches[int(match[1])] = int(match[2])
+        return batches
+
+    def save(self, start: int, stop: int, counts: pd.DataFrame) -> None:
+        """
+        Store the food counts of the batch of study files start to stop.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            counts.to_parquet(temp_path, index=False)
+            os.replace(temp_path, self._get_path(start, stop))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def load(self) -> pd.DataFrame:
+        """
+        Return: the food counts of all completed batches, in the order of their study files.
+        """
+        batches = sorted(self.get_batches().items())
+        return pd.concat(
+            [pd.read_parquet(self._get_path(start, stop)) for start, stop in batches],
+            ignore_index=True,
+        )
+
+    def clear(self) -> None:
+        """
+        Remove all batches.
+        """
+        for entry in os.scandir(self.directory):
+            if _BATCH_PATTERN.fullmatch(entry.name) or entry.name.endswith(".tmp"):
+                os.remove(entry.path)
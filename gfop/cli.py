@@ -0,0 +1,227 @@
+import argparse
+import concurrent.futures
+import glob
+import os
+import time
+from typing import List, Optional, Tuple
+
+# GNPS job groups, the same as in gfop.get_food_counts, which is only imported when used.
+_GROUPS = [f"G{i}" for i in range(1, 7)]
+
+
+def _expand_network(pattern: str) -> List[str]:
+    """
+    Parse a GNPS network argument, expanding a glob pattern into the paths it matches.
+    Paths without wildcards are kept as they are.
+    """
+    if not glob.has_magic(pattern):
+        return [pattern]
+    matches = sorted(glob.glob(pattern))
+    if len(matches) == 0:
+        raise argparse.ArgumentTypeError(f"no GNPS network matches {pattern}")
+    return matches
+
+
+def _expand_networks(patterns: List[List[str]]) -> List[str]:
+    """
+    Return: the paths of the GNPS networks to process, duplicates are dropped.
+    """
+    networks = []
+    for matches in patterns:
+        networks.extend(fn for fn in matches if fn not in networks)
+    return networks
+
+
+def _get_output_paths(
+    networks: List[str], output_dir: str, output_format: str
+) -> List[str]:
+    """
+    Return: the paths of the food counts files of the GNPS networks.
+    Networks with the same file name in different directories are told apart by their
+    directories relative to the directory they have in common.
+    """
+    names = [os.path.splitext(os.path.basename(network))[0] for network in networks]
+    for name in set(names):
+        same_name = [i for i, other in enumerate(names) if other == name]
+        if len(same_name) == 1:
+            continue
+        directories = [os.path.dirname(os.path.abspath(networks[i])) for i in same_name]
+        common = os.path.commonpath(directories)
+        for i, directory in zip(same_name, directories):
+            if directory != common:
+                prefix = os.path.relpath(directory, common).replace(os.sep, "_")
+                names[i] = f"{prefix}_{name}"
+    outputs = [
+        os.path.join(output_dir, f"{name}_food_counts.{output_format}")
+        for name in names
+    ]
+    duplicates = sorted({output for output in outputs if outputs.count(output) > 1})
+    if duplicates:
+        raise ValueError(
+            f"Several GNPS networks would be saved to {', '.join(duplicates)}, "
+            "rename them or process them separately"
+        )
+    return outputs
+
+
+def _count_network(
+    network: str, output: str, args: argparse.Namespace
+) -> Tuple[str, int, float]:
+    """
+    Generate and save the food counts of a single GNPS network to the output path.
+    Return: the output path, the number of food counts rows, and the run time in seconds.
+    """
+    import gfop.get_food_counts as gfop
+
+    start = time.perf_counter()
+    food_counts = gfop.get_dataset_food_counts_all(
+        network,
+        args.sample_types,
+        args.all_groups,
+        args.some_groups,
+        args.levels,
+        include_zeros=not args.drop_zeros,
+    )
+    if args.format == "parquet":
+        food_counts.to_parquet(output, index=False)
+    else:
+        food_counts.to_csv(output, index=False)
+    return output, len(food_counts), time.perf_counter() - start
+
+
+def _counts(args: argparse.Namespace) -> int:
+    """
+    Run the counts subcommand.
+    """
+    # The food counts, and numpy, pandas and scipy with them, are only imported when
+    # they are used, so that the command line help does not pay for them.
+    import gfop.get_food_counts as gfop
+
+    networks = _expand_networks(args.networks)
+    outputs = _get_output_paths(networks, args.output_dir, args.format)
+    os.makedirs(args.output_dir, exist_ok=True)
+    # Load the food ontology once, forked worker processes inherit it.
+    gfop.get_sample_types(args.sample_types)
+    start = time.perf_counter()
+    if args.jobs == 1:
+        results = [
+            _count_network(network, output, args)
+            for network, output in zip(networks, outputs)
+        ]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=None if args.jobs == -1 else args.jobs,
+            mp_context=gfop._get_mp_context(),
+        ) as executor:
+            results = list(
+                executor.map(_count_network, networks, outputs, [args] * len(networks))
+            )
+    total = time.perf_counter() - start
+    width = max(len(network) for network in networks)
+    print(f"{'network':<{width}}  {'rows':>10}  {'seconds':>8}  output")
+    for network, (output, rows, seconds) in zip(networks, results):
+        print(f"{network:<{width}}  {rows:>10}  {seconds:>8.2f}  {output}")
+    print(f"Processed {len(networks)} network(s) in {total:.2f} seconds.")
+    return 0
+
+
+def _get_jobs(value: str) -> int:
+    """
+    Parse the number of parallel jobs, a positive integer or -1.
+    """
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1 and jobs != -1:
+        raise argparse.ArgumentTypeError(
+            f"must be a positive integer or -1, not {value}"
+        )
+    return jobs
+
+
+def _get_parser() -> argparse.ArgumentParser:
+    """
+    Return: the parser of the gfop command line arguments.
+    """
+    parser = argparse.ArgumentParser(prog="gfop", description="Global FoodOmics")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    counts = subparsers.add_parser(
+        "counts",
+        help="generate food counts tables for GNPS molecular networks",
+        description="Generate food counts for all levels in long format for each GNPS "
+        "molecular network and save them next to each other in the output directory.",
+    )
+    counts.add_argument(
+        "networks",
+        nargs="+",
+        type=_expand_network,
+        help="tsv files generated from classical molecular networking, or glob patterns",
+    )
+    counts.add_argument(
+        "--sample-types",
+        choices=["simple", "complex", "all"],
+        default="all",
+        help="type of reference foods to count (default: all)",
+    )
+    counts.add_argument(
+        "--all-groups",
+        nargs="+",
+        required=True,
+        choices=_GROUPS,
+        metavar="GROUP",
+        help="groups of the study spectrum files, G1 to G6, e.g. G1",
+    )
+    counts.add_argument(
+        "--some-groups",
+        nargs="+",
+        required=True,
+        choices=_GROUPS,
+        metavar="GROUP",
+        help="groups of the reference spectrum files, G1 to G6, e.g. G4",
+    )
+    counts.add_argument(
+        "--levels",
+        type=int,
+        choices=range(0, 7),
+        metavar="LEVELS",
+        default=6,
+        help="number of ontology levels to count, 0 to 6 (default: 6)",
+    )
+    counts.add_argument(
+        "--drop-zeros",
+        action="store_true",
+        help="only save the non-zero food counts",
+    )
+    counts.add_argument(
+        "--output-dir",
+        default=".",
+        help="directory to save the food counts to (default: current directory)",
+    )
+    counts.add_argument(
+        "--format",
+        choices=["csv", "parquet"],
+        default="csv",
+        help="file format of the food counts (default: csv)",
+    )
+    counts.add_argument(
+        "--jobs",
+        type=_get_jobs,
+        default=1,
+        help="number of networks to process in parallel, -1 to use all processors "
+        "(default: 1)",
+    )
+    counts.set_defaults(func=_counts)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Entry point of the gfop command line interface.
+    """
+    args = _get_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,25 +1,221 @@
-import pkg_resources
+from __future__ import annotations
+
+import concurrent.futures
+import hashlib
+import importlib.resources
+import multiprocessing
+import os
+import sys
+from typing import (
+    Callable,
+    Container,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
 import numpy as np
 import pandas as pd
-from typing import List
+from scipy import sparse
+
+from gfop.cache import ResultCache
+from gfop.checkpoint import Checkpoint
+from gfop.profiling import profiled, stage
+from gfop.progress import CancellationToken, ProgressTracker
+
+_FOOD_METADATA = "data/foodomics_multiproject_metadata.txt"
+_FOOD_ONTOLOGY = "data/foodomics_ontology.npz"
+_FOOD_ONTOLOGY_VERSION = 1
+_FOOD_ONTOLOGY_COLUMNS = [
+    "filename",
+    "sample_name",
+    "simple_complex",
+    *[f"sample_type_group{i}" for i in range(1, 7)],
+]
+
+# Default number of study files per batch of a checkpointed run.
+_CHECKPOINT_BATCH_SIZE = 1000
+
+# Version of the food counts computation, part of the result cache keys.
+# Increase it whenever a change alters the food counts.
+_FOOD_COUNTS_VERSION = 2
+
+_GROUPS = [f"G{i}" for i in range(1, 7)]
+_NETWORK_DTYPES = {
+    "DefaultGroups": str,
+    "UniqueFileSources": str,
+    **{group: "int32" for group in _GROUPS},
+}
+
+# Parsed Global FoodOmics metadata and ontology, keyed by the (path, mtime) of the
+# metadata resource so that they are reloaded when the resource changes.
+_food_metadata_cache: Dict[Tuple[str, float], pd.DataFrame] = {}
+_food_ontology_cache: Dict[Tuple[str, float], pd.DataFrame] = {}
+_sample_types_cache: Dict[Tuple[Tuple[str, float], str], pd.DataFrame] = {}
+
+# Content hashes of files, keyed by their (path, size, mtime).
+_file_hash_cache: Dict[Tuple[str, int, int], str] = {}
+
+# Study and reference incidence matrices shared with the worker processes that compute
+# the reference matches of a shard of study files.
+_shared_matches: Optional[Tuple[sparse.csc_matrix, sparse.csr_matrix]] = None
+
+
+def clear_food_metadata_cache() -> None:
+    """
+    Discard the cached Global FoodOmics ontology and metadata.
+    The next call to load_food_metadata() or get_sample_types() reads it again.
+    """
+    _food_metadata_cache.clear()
+    _food_ontology_cache.clear()
+    _sample_types_cache.clear()
+
+
+def _get_resource_path(resource: str) -> str:
+    """
+    Return: the path of a data file shipped with the package.
+    """
+    return str(importlib.resources.files(__package__).joinpath(resource))
+
+
+def _get_food_metadata_key() -> Tuple[str, float]:
+    """
+    Identify the current version of the Global FoodOmics metadata resource.
+    Return: the path and modification time of the metadata file.
+    """
+    path = _get_resource_path(_FOOD_METADATA)
+    return path, os.path.getmtime(path)
+
+
+def _hash_file(path: str) -> str:
+    """
+    Return: the SHA-256 hex digest of the contents of a file.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
 
+def _hash_file_cached(path: str) -> str:
+    """
+    Return: the SHA-256 hex digest of the contents of a file, hashed again only when it changes.
+    """
+    stat = os.stat(path)
+    key = os.path.realpath(path), stat.st_size, stat.st_mtime_ns
+    if key not in _file_hash_cache:
+        _file_hash_cache[key] = _hash_file(path)
+    return _file_hash_cache[key]
+
+
+def _load_food_metadata(key: Tuple[str, float]) -> pd.DataFrame:
+    """
+    Read Global FoodOmics ontology and metadata, or get it from the cache.
+    The returned dataframe is shared and must not be modified.
+    """
+    if key not in _food_metadata_cache:
+        gfop_metadata = pd.read_csv(key[0], sep="\t")
+        # Remove trailing whitespace
+        gfop_metadata = gfop_metadata.apply(
+            lambda col: (
+                col.str.strip() if pd.api.types.is_string_dtype(col.dtype) else col
+            )
+        )
+        _food_metadata_cache.clear()
+        _food_metadata_cache[key] = gfop_metadata
+    return _food_metadata_cache[key]
 
+
+@profiled
 def load_food_metadata() -> pd.DataFrame:
     """
     Read Global FoodOmics ontology and metadata.
+    The metadata is parsed once and cached until the metadata file changes
+    or clear_food_metadata_cache() is called.
     Return: a dataframe containing Global FoodOmics ontology and metadata.
     """
-    stream = pkg_resources.resource_stream(
-        __name__, "data/foodomics_multiproject_metadata.txt"
-    )
-    gfop_metadata = pd.read_csv(stream, sep="\t")
-    # Remove trailing whitespace
-    gfop_metadata = gfop_metadata.apply(
-        lambda col: col.str.strip() if col.dtype == "object" else col
-    )
-    return gfop_metadata
+    return _load_food_metadata(_get_food_metadata_key()).copy()
+
+
+def build_food_ontology() -> str:
+    """
+    Compile the Global FoodOmics ontology into the binary artifact shipped with the package.
+    Only the filename, sample_name, simple_complex and sample_type_group1..6 columns are kept,
+    stored as categorical codes of whitespace-stripped strings.
+    Run this after updating the Global FoodOmics metadata file.
+    Return: the path of the compiled ontology.
+    """
+    key = _get_food_metadata_key()
+    gfop_ontology = _load_food_metadata(key)[_FOOD_ONTOLOGY_COLUMNS]
+    arrays = {
+        "version": np.array(_FOOD_ONTOLOGY_VERSION),
+        "source_sha256": np.array(_hash_file(key[0])),
+    }
+    for col in _FOOD_ONTOLOGY_COLUMNS:
+        codes, categories = pd.factorize(gfop_ontology[col])
+        arrays[f"{col}_codes"] = codes.astype(np.int32)
+        arrays[f"{col}_categories"] = np.asarray(categories, dtype=str)
+    path = _get_resource_path(_FOOD_ONTOLOGY)
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    return path
+
+
+def _read_food_ontology(metadata_path: str) -> Optional[pd.DataFrame]:
+    """
+    Read the compiled Global FoodOmics ontology.
+    Return: the ontology, or None if the artifact is missing or does not match the metadata file.
+    """
+    path = _get_resource_path(_FOOD_ONTOLOGY)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as arrays:
+        if arrays["version"] != _FOOD_ONTOLOGY_VERSION or arrays[
+            "source_sha256"
+        ] != _hash_file(metadata_path):
+            return None
+        gfop_ontology = {}
+        for col in _FOOD_ONTOLOGY_COLUMNS:
+            # Code -1 denotes a missing value.
+            categories = np.append(arrays[f"{col}_categories"].astype(object), np.nan)
+            gfop_ontology[col] = categories[arrays[f"{col}_codes"]]
+    return pd.DataFrame(gfop_ontology)
+
+
+def _load_food_ontology(key: Tuple[str, float]) -> pd.DataFrame:
+    """
+    Read Global FoodOmics ontology, or get it from the cache.
+    The returned dataframe is shared and must not be modified.
+    """
+    if key not in _food_ontology_cache:
+        gfop_ontology = _read_food_ontology(key[0])
+        if gfop_ontology is None:
+            gfop_ontology = _load_food_metadata(key)[_FOOD_ONTOLOGY_COLUMNS]
+        _food_ontology_cache.clear()
+        _food_ontology_cache[key] = gfop_ontology
+    return _food_ontology_cache[key]
+
+
+@profiled
+def load_food_ontology() -> pd.DataFrame:
+    """
+    Read Global FoodOmics ontology.
+    The compiled ontology shipped with the package is used when it is up to date with the
+    metadata file, otherwise the ontology is read from the metadata file.
+    The ontology is cached until the metadata file changes or clear_food_metadata_cache() is called.
+    Return:
+        A dataframe with the filename, sample_name, simple_complex and sample_type_group1..6
+        columns of the Global FoodOmics metadata.
+    """
+    return _load_food_ontology(_get_food_metadata_key()).copy()
 
 
+@profiled
 def get_sample_types(simple_complex: str = "all") -> pd.DataFrame:
     """
     Filter Global FoodOmics metadata by simple, complex or all type of foods.
@@ -30,13 +226,301 @@ def get_sample_types(simple_complex: str = "all") -> pd.DataFrame:
                                  Simple foods are single ingredients while complex foods contain multiple ingredients.
                                  'all' will return both simple and complex foods.
     """
-    gfop_metadata = load_food_metadata()
-    if simple_complex != "all":
-        gfop_metadata = gfop_metadata[gfop_metadata["simple_complex"] == simple_complex]
-    col_sample_types = ["sample_name"] + [f"sample_type_group{i}" for i in range(1, 7)]
-    return gfop_metadata[["filename", *col_sample_types]].set_index("filename")
+    key = _get_food_metadata_key()
+    if (key, simple_complex) not in _sample_types_cache:
+        gfop_ontology = _load_food_ontology(key)
+        if simple_complex != "all":
+            gfop_ontology = gfop_ontology[
+                gfop_ontology["simple_complex"] == simple_complex
+            ]
+        col_sample_types = ["sample_name"] + [
+            f"sample_type_group{i}" for i in range(1, 7)
+        ]
+        _sample_types_cache[key, simple_complex] = gfop_ontology[
+            ["filename", *col_sample_types]
+        ].set_index("filename")
+    return _sample_types_cache[key, simple_complex].copy()
 
 
+@profiled
+def read_gnps_network(
+    gnps_network: str, engine: str = "c", chunksize: Optional[int] = None
+) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    """
+    Read the columns needed to count foods from a GNPS molecular network.
+    Only the DefaultGroups, UniqueFileSources and G1..G6 columns are parsed,
+    with the group spectrum counts as fixed-width integers.
+
+    Return:
+        Dataframe with the DefaultGroups, UniqueFileSources and G1..G6 columns of the network.
+    Args:
+        gnps_network (string): path to tsv file generated from classical molecular networking
+                               with study dataset(s) and reference dataset.
+        engine (string): parser engine passed to pandas.read_csv, e.g. 'c' or 'pyarrow'.
+                         The pyarrow engine parses large networks faster but requires pyarrow.
+        chunksize (integer): if given, iterate over the network in chunks of this many clusters.
+                             Not supported by the pyarrow engine.
+    Examples:
+        read_gnps_network(gnps_network = 'METABOLOMICS-SNETS-V2-07f85565-view_all_clusters_withID_beta-main.tsv',
+                          engine = 'pyarrow')
+    """
+    return pd.read_csv(
+        gnps_network,
+        sep="\t",
+        usecols=list(_NETWORK_DTYPES),
+        dtype=_NETWORK_DTYPES,
+        engine=engine,
+        chunksize=chunksize,
+    )
+
+
+def _get_group_presence(gnps_network: pd.DataFrame) -> np.ndarray:
+    """
+    Return: a boolean clusters x groups array of which of G1 to G6 each cluster contains.
+    """
+    return gnps_network[_GROUPS].to_numpy() > 0
+
+
+def _select_clusters(
+    presence: np.ndarray, all_groups: List[str], some_groups: List[str]
+) -> np.ndarray:
+    """
+    Select the clusters shared by the study and reference groups.
+    A cluster is selected when it contains spectra from all study groups, from at least
+    one reference group, and from none of the remaining groups.
+    Return: a boolean mask over the clusters of the group presence obtained using _get_group_presence().
+    """
+    all_groups = [_GROUPS.index(group) for group in all_groups]
+    some_groups = [_GROUPS.index(group) for group in some_groups]
+    groups_excluded = sorted(set(range(len(_GROUPS))) - {*all_groups, *some_groups})
+    return (
+        presence[:, all_groups].all(axis=1)
+        & presence[:, some_groups].any(axis=1)
+        & ~presence[:, groups_excluded].any(axis=1)
+    )
+
+
+class GroupSelection:
+    """
+    Selection of the clusters of a GNPS molecular network for one group configuration.
+
+    The selection only depends on the groups of the clusters, so it is computed once and
+    shared by all files and levels, see NetworkIndex.select_groups().
+
+    Args:
+        presence (array): obtained using _get_group_presence().
+        all_groups (list): can contain 'G1', 'G2' to denote study spectrum files.
+        some_groups (list): can contain 'G3', 'G4' to denote reference spectrum files.
+    Attributes:
+        positions (array): sorted positions of the selected clusters.
+    """
+
+    def __init__(
+        self, presence: np.ndarray, all_groups: List[str], some_groups: List[str]
+    ):
+        self.all_groups = list(all_groups)
+        self.some_groups = list(some_groups)
+        with stage("select_groups", len(presence)) as selection_stage:
+            self.positions = np.flatnonzero(
+                _select_clusters(presence, all_groups, some_groups)
+            )
+            selection_stage.rows_out = len(self.positions)
+
+    def contains(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Return: a boolean mask of which of the given cluster positions are selected.
+        """
+        if len(self.positions) == 0:
+            return np.zeros(len(positions), dtype=bool)
+        found = np.searchsorted(self.positions, positions)
+        found = np.minimum(found, len(self.positions) - 1)
+        return self.positions[found] == positions
+
+
+def _get_group_key(
+    all_groups: List[str], some_groups: List[str]
+) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """
+    Return: the key of a group configuration, independent of the order of the groups.
+    """
+    return tuple(sorted(set(all_groups))), tuple(sorted(set(some_groups)))
+
+
+class NetworkIndex:
+    """
+    Index of the clusters of a GNPS molecular network by the files they contain.
+
+    The UniqueFileSources of all clusters are split once into a sparse clusters x files
+    incidence matrix, where each entry counts how often a file occurs in a cluster,
+    so that the clusters containing a file are found without scanning the network.
+    Files are matched by their exact name.
+    The index covers all clusters and can be reused for any groups, levels and sample types.
+
+    Clusters with the same files and the same groups count the same foods, so by default
+    they are collapsed into a single row of the incidence matrix with a multiplicity weight.
+    Memory use and counting time then scale with the number of distinct clusters.
+
+    Args:
+        gnps_network (dataframe): Dataframe generated from classical molecular networking
+                                  with study dataset(s) and reference dataset.
+        collapse (boolean): whether to collapse clusters with identical files and groups.
+    Examples:
+        network_index = NetworkIndex(read_gnps_network('METABOLOMICS-SNETS-V2-07f85565-view_all_clusters_withID_beta-main.tsv'))
+        network_index.get_clusters('sample1.mzXML')
+    """
+
+    def __init__(self, gnps_network: pd.DataFrame, collapse: bool = True):
+        with stage("NetworkIndex", len(gnps_network)) as index_stage:
+            self.gnps_network = gnps_network
+            files = (
+                gnps_network["UniqueFileSources"]
+                .reset_index(drop=True)
+                .str.split("|")
+                .explode()
+                .dropna()
+            )
+            file_ids, self.filenames = pd.factorize(files)
+            incidence = sparse.csr_matrix(
+                (
+                    np.ones(len(file_ids), dtype=np.int32),
+                    (files.index.to_numpy(), file_ids),
+                ),
+                shape=(len(gnps_network), len(self.filenames)),
+            )
+            # The groups are read once and shared by the selections of all group configurations.
+            presence = _get_group_presence(gnps_network)
+            if collapse:
+                cluster_rows, clusters = _get_distinct_clusters(
+                    incidence, presence, self.filenames
+                )
+            else:
+                cluster_rows = clusters = np.arange(len(gnps_network))
+            # Distinct clusters: their positions in the network, multiplicity and files.
+            self.clusters = clusters
+            self.weights = np.bincount(cluster_rows, minlength=len(clusters)).astype(
+                np.int32
+            )
+            self.incidence = incidence[clusters]
+            self._group_presence = presence[clusters]
+            self._incidence_csc = self.incidence.tocsc()
+            # Positions in the network of the clusters collapsed into each distinct cluster.
+            self._row_clusters = np.argsort(cluster_rows, kind="stable")
+            self._row_indptr = np.concatenate([[0], np.cumsum(self.weights)])
+            self._group_selections = {}
+            index_stage.rows_out = len(self.clusters)
+
+    def select_groups(
+        self, all_groups: List[str], some_groups: List[str]
+    ) -> GroupSelection:
+        """
+        Return:
+            The selection of the distinct clusters for the given groups,
+            cached per group configuration.
+        """
+        key = _get_group_key(all_groups, some_groups)
+        if key not in self._group_selections:
+            self._group_selections[key] = GroupSelection(
+                self._group_presence, all_groups, some_groups
+            )
+        return self._group_selections[key]
+
+    def get_file_ids(self, filenames: List[str]) -> np.ndarray:
+        """
+        Return: the file IDs of the given filenames, -1 for files not in the network.
+        """
+        return self.filenames.get_indexer(filenames)
+
+    def select_files(self, filenames: List[str]) -> sparse.csr_matrix:
+        """
+        Return:
+            A sparse files x len(filenames) matrix that selects the given files from the incidence matrix.
+            Columns of files that are not in the network are empty.
+        """
+        file_ids = self.get_file_ids(filenames)
+        columns = np.flatnonzero(file_ids >= 0)
+        return sparse.csr_matrix(
+            (np.ones(len(columns), dtype=np.int32), (file_ids[columns], columns)),
+            shape=(len(self.filenames), len(file_ids)),
+        )
+
+    def get_clusters(
+        self, filename: str, selection: Optional[GroupSelection] = None
+    ) -> np.ndarray:
+        """
+        Return:
+            The sorted positions of the clusters that contain the given file,
+            restricted to the clusters of the selection obtained using select_groups() if given.
+        """
+        file_id = self.get_file_ids([filename])[0]
+        if file_id < 0:
+            return np.empty(0, dtype=np.int64)
+        indptr = self._incidence_csc.indptr
+        rows = self._incidence_csc.indices[indptr[file_id] : indptr[file_id + 1]]
+        if selection is not None:
+            rows = rows[selection.contains(rows)]
+        # Expand the distinct clusters into all clusters collapsed into them.
+        starts, sizes = self._row_indptr[rows], self.weights[rows]
+        offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        return np.sort(self._row_clusters[np.repeat(starts, sizes) + offsets])
+
+
+def _sum_hashes(matrix: sparse.csr_matrix, hashes: np.ndarray) -> np.ndarray:
+    """
+    Return: the sums modulo 2^64 of the hashes of the columns of each row, times their entries.
+    """
+    sums = hashes[matrix.indices] * matrix.data.astype(np.uint64)
+    sums = np.concatenate([np.zeros(1, np.uint64), np.cumsum(sums)])
+    return sums[matrix.indptr[1:]] - sums[matrix.indptr[:-1]]
+
+
+def _hash_clusters(
+    incidence: sparse.csr_matrix,
+    filenames: pd.Index,
+    files: Optional[np.ndarray] = None,
+) -> List[np.ndarray]:
+    """
+    Hash the multiset of the files of each cluster, as the sums of the hashes of its filenames.
+
+    Return: two independent 64-bit hashes of each cluster.
+    Args:
+        incidence (sparse matrix): clusters x files incidence matrix.
+        filenames (index): names of the files of the columns of incidence.
+        files (array): if given, boolean mask of the files to hash, the others are ignored.
+    """
+    cluster_hashes = []
+    for hash_key in ["gfop-clusters-a0", "gfop-clusters-b1"]:
+        file_hashes = pd.util.hash_array(filenames.to_numpy(), hash_key=hash_key)
+        if files is not None:
+            file_hashes[~files] = 0
+        cluster_hashes.append(_sum_hashes(incidence, file_hashes))
+    return cluster_hashes
+
+
+def _get_distinct_clusters(
+    incidence: sparse.csr_matrix, presence: np.ndarray, filenames: pd.Index
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the clusters with identical files and groups.
+
+    Each cluster is identified by two 64-bit hashes of the multiset of its files,
+    the sums of the hashes of its filenames, and by which groups it contains.
+
+    Return:
+        The distinct cluster of each cluster, and the position of the first cluster of
+        each distinct cluster.
+    """
+    keys = np.column_stack([*presence.T, *_hash_clusters(incidence, filenames)])
+    _, clusters, cluster_rows = np.unique(
+        keys, axis=0, return_index=True, return_inverse=True
+    )
+    # Number the distinct clusters in order of first occurrence.
+    order = np.argsort(clusters)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[cluster_rows.ravel()], clusters[order]
+
+
+@profiled
 def get_sample_metadata(
     gnps_network: pd.DataFrame, all_groups: List[str]
 ) -> pd.DataFrame:
@@ -64,6 +548,7 @@ def get_sample_metadata(
     return filenames_df
 
 
+@profiled
 def get_file_food_counts(
     gnps_network: pd.DataFrame,
     sample_types: pd.DataFrame,
@@ -71,6 +556,7 @@ def get_file_food_counts(
     some_groups: List[str],
     filename: str,
     level: int,
+    network_index: Optional[NetworkIndex] = None,
 ) -> pd.Series:
     """
     Generate food counts for an individual sample in a study dataset.
@@ -82,10 +568,14 @@ def get_file_food_counts(
         sample_types (dataframe): obtained using get_sample_types().
         all_groups (list): can contain 'G1', 'G2' to denote study spectrum files.
         some_groups (list): can contain 'G3', 'G4' to denote reference spectrum files.
-        filename (string): name of study sample mzXML file.
+        filename (string): name of study sample mzXML file, or a list of names.
+                           Filenames are matched exactly against the files of each cluster.
         level (integer): indicates the level of the food ontology to use.
                          One of 1, 2, 3, 4, 5, 6, or 0.
                          0 will return counts for individual reference spectrum files, rather than food categories.
+        network_index (NetworkIndex): optional index of gnps_network.
+                                      Its clusters are looked up by exact filename instead of scanning the network,
+                                      and the group selection is computed once and reused across calls.
     Return:
         A vector
     Examples:
@@ -96,32 +586,42 @@ def get_file_food_counts(
                              filename = 'sample1.mzXML',
                              level = 5)
     """
-    # Select GNPS job groups.
-    groups = {f"G{i}" for i in range(1, 7)}
-    groups_excluded = list(groups - set([*all_groups, *some_groups]))
-    df_selected = gnps_network[
-        (gnps_network[all_groups] > 0).all(axis=1)
-        & (gnps_network[some_groups] > 0).any(axis=1)
-        & (gnps_network[groups_excluded] == 0).all(axis=1)
-    ].copy()
-    df_selected = df_selected[
-        df_selected["UniqueFileSources"].apply(
-            lambda cluster_fn: any(fn in cluster_fn for fn in filename)
+    filename = [filename] if isinstance(filename, str) else filename
+    if network_index is not None:
+        # Select GNPS job groups once per group configuration.
+        selection = network_index.select_groups(all_groups, some_groups)
+        clusters = np.unique(
+            np.concatenate(
+                [network_index.get_clusters(fn, selection) for fn in filename]
+                + [np.empty(0, dtype=np.int64)]
+            )
         )
-    ]
-    filenames = df_selected["UniqueFileSources"].str.split("|").explode()
+        df_selected = gnps_network.iloc[clusters]
+        filenames = df_selected["UniqueFileSources"].str.split("|").explode()
+    else:
+        # Select GNPS job groups.
+        selection = GroupSelection(
+            _get_group_presence(gnps_network), all_groups, some_groups
+        )
+        # Split the file lists of the clusters once and match the filenames exactly.
+        filenames = (
+            gnps_network["UniqueFileSources"]
+            .iloc[selection.positions]
+            .reset_index(drop=True)
+            .str.split("|")
+            .explode()
+        )
+        selected_file = np.zeros(len(selection.positions), dtype=bool)
+        selected_file[filenames.index[filenames.isin(filename)]] = True
+        filenames = filenames[selected_file[filenames.index]]
     # Select food hierarchy levels.
-    sample_types = sample_types[
-        f"sample_type_group{level}" if level > 0 else "sample_name"
-    ]
+    water_types = sample_types[_get_water_column(level)]
+    sample_types = sample_types[_get_level_column(level)]
     # Match the GNPS job results to the food sample types.
     sample_types_selected = sample_types.reindex(filenames)
     sample_types_selected = sample_types_selected.dropna()
     # Discard samples that occur less frequent than water (blank).
-    if level > 0:
-        water_count = (sample_types_selected == "water").sum()
-    else:
-        water_count = 0  # TO-DO implement filtering for file-level counts
+    water_count = (water_types.reindex(filenames) == "water").sum()
     sample_counts = sample_types_selected.value_counts()
     sample_counts_valid = sample_counts.index[sample_counts > water_count]
     sample_types_selected = sample_types_selected[
@@ -131,12 +631,786 @@ def get_file_food_counts(
     return sample_types_selected.value_counts()
 
 
+def _iter_reference_matches(
+    network_index: NetworkIndex,
+    sample_types: pd.DataFrame,
+    all_groups: List[str],
+    some_groups: List[str],
+    filenames: pd.Series,
+    n_jobs: int = 1,
+    batch_size: Optional[int] = None,
+    skip: Container[int] = (),
+) -> Iterator[Tuple[int, int, sparse.csr_matrix]]:
+    """
+    Count the matches of the study samples to the reference samples they share a cluster with,
+    in batches of study files.
+
+    The matches are the product (study file incidence)^T x (reference file incidence)
+    over the selected clusters of the network.
+
+    Return:
+        An iterator over the batches in order, with the positions start and stop of the
+        study files of the batch in filenames, and their sparse study files x reference files
+        matrix of match counts, with the columns in the order of sample_types.
+    Args:
+        network_index (NetworkIndex): index of the GNPS molecular network.
+        sample_types (dataframe): obtained using get_sample_types().
+        all_groups (list): can contain 'G1', 'G2' to denote study spectrum files.
+        some_groups (list): can contain 'G3', 'G4' to denote reference spectrum files.
+        filenames (series): names of the study sample mzXML files.
+        n_jobs (integer): number of worker processes, -1 to use all processors.
+        batch_size (integer): number of study files per batch, by default all files
+                              in a single batch, or one batch per worker process.
+        skip (container): start positions of the batches not to count, such as those
+                          that are already complete.
+    """
+    selected = network_index.select_groups(all_groups, some_groups).positions
+    incidence = network_index.incidence[selected]
+    study = (incidence @ network_index.select_files(filenames) > 0).astype(np.int32)
+    # Count the reference files of each collapsed cluster as often as it occurs.
+    reference = incidence.multiply(network_index.weights[selected, np.newaxis])
+    reference = reference.tocsr() @ network_index.select_files(sample_types.index)
+    n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+    n_files = study.shape[1]
+    parallel = n_jobs > 1 and n_files > 1
+    if batch_size is not None:
+        bounds = np.unique(np.append(np.arange(0, n_files, batch_size), n_files))
+    elif parallel:
+        bounds = np.linspace(0, n_files, min(n_jobs, n_files) + 1).astype(int)
+    else:
+        bounds = np.array([0, n_files])
+    batches = [
+        (start, stop)
+        for start, stop in zip(bounds[:-1], bounds[1:])
+        if start not in skip
+    ]
+    if parallel:
+        yield from _iter_parallel_matches(study.tocsc(), reference, n_jobs, batches)
+    elif len(bounds) == 2:
+        for start, stop in batches:
+            yield start, stop, (study.T @ reference).tocsr()
+    else:
+        study = study.tocsc()
+        for start, stop in batches:
+            yield start, stop, (study[:, start:stop].T @ reference).tocsr()
+
+
+def _stack_matches(shards: List[sparse.csr_matrix], n_references: int):
+    """
+    Return: the reference matches of consecutive batches of study files as a single matrix.
+    """
+    if len(shards) == 0:
+        return sparse.csr_matrix((0, n_references), dtype=np.int32)
+    return shards[0] if len(shards) == 1 else sparse.vstack(shards, format="csr")
+
+
+@profiled
+def _get_reference_matches(
+    network_index: NetworkIndex,
+    sample_types: pd.DataFrame,
+    all_groups: List[str],
+    some_groups: List[str],
+    filenames: pd.Series,
+    n_jobs: int = 1,
+) -> sparse.csr_matrix:
+    """
+    Count the matches of the study samples to the reference samples they share a cluster with.
+
+    Return:
+        A sparse study files x reference files matrix of match counts,
+        with the rows in the order of filenames and the columns in the order of sample_types.
+    Args:
+        See _iter_reference_matches().
+    """
+    shards = [
+        shard
+        for _, _, shard in _iter_reference_matches(
+            network_index, sample_types, all_groups, some_groups, filenames, n_jobs
+        )
+    ]
+    return _stack_matches(shards, len(sample_types))
+
+
+def _init_shared_matches(study: sparse.csc_matrix, reference: sparse.csr_matrix):
+    """
+    Share the study and reference incidence matrices with a worker process.
+    """
+    global _shared_matches
+    _shared_matches = study, reference
+
+
+def _get_shard_matches(start: int, stop: int) -> sparse.csr_matrix:
+    """
+    Count the reference matches of the study files start to stop in a worker process.
+    """
+    study, reference = _shared_matches
+    return (study[:, start:stop].T @ reference).tocsr()
+
+
+def _get_mp_context() -> multiprocessing.context.BaseContext:
+    """
+    Return: the multiprocessing context of the worker processes.
+    Workers are forked on Linux, where they inherit the loaded data without copying it.
+    Other platforms use their default start method, as forking is unsafe on macOS.
+    """
+    return multiprocessing.get_context(
+        "fork" if sys.platform.startswith("linux") else None
+    )
+
+
+def _iter_parallel_matches(
+    study: sparse.csc_matrix,
+    reference: sparse.csr_matrix,
+    n_jobs: int,
+    batches: List[Tuple[int, int]],
+) -> Iterator[Tuple[int, int, sparse.csr_matrix]]:
+    """
+    Count the reference matches of the study files in shards across worker processes.
+
+    The incidence matrices are passed to each worker once when it starts, which does not
+    copy them on Linux where they are forked, and each task only receives its shard bounds.
+    The shards are returned in order, so stacking them is identical to the serial product.
+    When the iteration is stopped early, the shards that have not started are cancelled.
+
+    Return:
+        An iterator over the (start, stop) bounds of the shards and their sparse study files x reference files
+        matrices of match counts.
+    """
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=n_jobs,
+        mp_context=_get_mp_context(),
+        initializer=_init_shared_matches,
+        initargs=(study, reference),
+    ) as executor:
+        futures = [
+            executor.submit(_get_shard_matches, start, stop) for start, stop in batches
+        ]
+        try:
+            for (start, stop), future in zip(batches, futures):
+                yield start, stop, future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def _get_level_column(level: int) -> str:
+    """
+    Name of the sample types column holding the food ontology at the given level.
+    """
+    return f"sample_type_group{level}" if level > 0 else "sample_name"
+
+
+def _get_water_column(level: int) -> str:
+    """
+    Name of the sample types column identifying the water (blank) reference files at the
+    given level. Individual files are water blanks if their first ontology level is water.
+    """
+    return _get_level_column(level if level > 0 else 1)
+
+
+@profiled
+def _count_food_matches(
+    matches: sparse.csr_matrix, food_types: np.ndarray
+) -> Tuple[sparse.csr_matrix, pd.Index]:
+    """
+    Count the food matches of all study samples at one ontology level.
+    The counts are the product of the reference matches with the one-hot encoding
+    of the reference files' food types, not yet filtered by the water (blank) counts.
+
+    Return:
+        A sparse study files x food types matrix of counts, and the sorted food types.
+    Args:
+        matches (sparse matrix): obtained using _get_reference_matches().
+        food_types (array): food type of each reference file of the matches.
+    """
+    codes, categories = pd.factorize(food_types, sort=True)
+    # Reference files without a food type (code -1) are not counted.
+    references = np.flatnonzero(codes >= 0)
+    one_hot = sparse.csr_matrix(
+        (np.ones(len(references), dtype=np.int32), (references, codes[references])),
+        shape=(len(codes), len(categories)),
+    )
+    return (matches @ one_hot).tocsr(), pd.Index(categories)
+
+
+def _get_food_types(sample_types: pd.DataFrame, level: int) -> pd.Index:
+    """
+    Return: the sorted food types at one ontology level, the columns of the counts of _count_food_matches().
+    """
+    food_types = sample_types[_get_level_column(level)].to_numpy()
+    return pd.Index(pd.factorize(food_types, sort=True)[1])
+
+
+@profiled
+def _count_water_matches(
+    matches: sparse.csr_matrix, water_types: np.ndarray
+) -> np.ndarray:
+    """
+    Count the water (blank) matches of all study samples in a single pass.
+
+    Return:
+        The water count of each study file.
+    Args:
+        matches (sparse matrix): obtained using _get_reference_matches().
+        water_types (array): food type of each reference file of the matches in the
+            column given by _get_water_column().
+    """
+    is_water = (water_types == "water").astype(np.int32)
+    return np.asarray(matches @ is_water).ravel()
+
+
+def _filter_water_counts(
+    counts: sparse.csr_matrix, water_count: np.ndarray
+) -> sparse.coo_matrix:
+    """
+    Discard the food counts of each study sample that are not higher than its water (blank) count.
+
+    Return:
+        The sparse study files x food types matrix of the remaining counts.
+    Args:
+        counts (sparse matrix): obtained using _count_food_matches().
+        water_count (array): obtained using _count_water_matches().
+    """
+    counts = counts.tocoo()
+    valid = counts.data > water_count[counts.row]
+    return sparse.coo_matrix(
+        (counts.data[valid], (counts.row[valid], counts.col[valid])),
+        shape=counts.shape,
+    )
+
+
+def _get_level_counts(
+    matches: sparse.csr_matrix, sample_types: pd.DataFrame, level: int
+) -> Tuple[sparse.coo_matrix, pd.Index]:
+    """
+    Count the food matches of all study samples at one ontology level and discard the
+    counts that are not higher than the water (blank) counts.
+
+    Return:
+        The sparse study files x food types matrix of counts, and the sorted food types.
+    Args:
+        matches (sparse matrix): obtained using _get_reference_matches(), or the matches
+                                 of the leaves of the food ontology obtained using _count_leaf_matches().
+        sample_types (dataframe): sample types of the columns of matches.
+        level (integer): indicates the level of the food ontology to use.
+    """
+    food_types = sample_types[_get_level_column(level)].to_numpy()
+    counts, food_types = _count_food_matches(matches, food_types)
+    water_types = sample_types[_get_water_column(level)].to_numpy()
+    water_count = _count_water_matches(matches, water_types)
+    return _filter_water_counts(counts, water_count), food_types
+
+
+def _get_ontology_leaves(
+    sample_types: pd.DataFrame, levels: int
+) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+    Collapse the reference files with the same food types at the levels 0 to levels,
+    and the same water (blank) types, into the leaves of the food ontology.
+    Each leaf has a single food type at each level, so the food types of the leaves map
+    them to their parents at every level.
+
+    Return:
+        The leaf of each reference file, and the sample types of the leaves with the
+        food types and water types columns of the levels.
+    """
+    columns = list(
+        dict.fromkeys(
+            [_get_level_column(level) for level in range(levels + 1)]
+            + [_get_water_column(level) for level in range(levels + 1)]
+        )
+    )
+    codes = np.column_stack(
+        [pd.factorize(sample_types[column].to_numpy())[0] for column in columns]
+    )
+    _, first, leaves = np.unique(codes, axis=0, return_index=True, return_inverse=True)
+    return leaves.ravel(), sample_types[columns].iloc[first].reset_index(drop=True)
+
+
+@profiled
+def _count_leaf_matches(
+    matches: sparse.csr_matrix, leaves: np.ndarray, n_leaves: int
+) -> sparse.csr_matrix:
+    """
+    Count the matches of all study samples with each leaf of the food ontology.
+
+    Return:
+        A sparse study files x leaves matrix of counts.
+    Args:
+        matches (sparse matrix): obtained using _get_reference_matches().
+        leaves (array): leaf of each reference file obtained using _get_ontology_leaves().
+        n_leaves (integer): number of leaves.
+    """
+    one_hot = sparse.csr_matrix(
+        (np.ones(len(leaves), dtype=np.int32), (np.arange(len(leaves)), leaves)),
+        shape=(len(leaves), n_leaves),
+    )
+    return (matches @ one_hot).tocsr()
+
+
+def _iter_level_counts(
+    matches: sparse.csr_matrix, sample_types: pd.DataFrame, levels: int
+) -> Iterator[Tuple[int, sparse.coo_matrix, pd.Index]]:
+    """
+    Count the food matches of all study samples at the levels 0 to levels.
+    The matches are counted once per leaf of the food ontology, and rolled up from the
+    leaves to the food types of each level before the water (blank) counts are discarded.
+
+    Return: an iterator over the levels 0 to levels and their counts obtained using _get_level_counts().
+    """
+    leaves, leaf_types = _get_ontology_leaves(sample_types, levels)
+    leaf_matches = _count_leaf_matches(matches, leaves, len(leaf_types))
+    for level in range(levels + 1):
+        yield (level, *_get_level_counts(leaf_matches, leaf_types, level))
+
+
+@profiled
+def _get_level_food_counts(
+    counts: sparse.coo_matrix,
+    food_types: pd.Index,
+    level: int,
+    filenames: pd.Series,
+) -> pd.DataFrame:
+    """
+    Build the food counts table at a single ontology level.
+
+    Return:
+        A data frame of food counts with one row per study sample with at least one count.
+    Args:
+        counts (sparse matrix): obtained using _get_level_counts().
+        food_types (index): food types of the columns of counts.
+        level (integer): indicates the level of the food ontology to use.
+        filenames (series): names of the study sample mzXML files, the rows of counts.
+    """
+    counts = counts.tocsr()
+    # Get sample counts at the specified level.
+    rows = np.flatnonzero(counts.getnnz(axis=1))
+    cols = np.flatnonzero(counts.getnnz(axis=0))
+    return pd.DataFrame(
+        counts[rows][:, cols].toarray().astype(np.int64),
+        index=pd.Index(np.asarray(filenames)[rows], name="filename"),
+        columns=pd.Index(food_types[cols], name=_get_level_column(level)),
+    )
+
+
+@profiled
+def _get_level_food_counts_long(
+    counts: sparse.coo_matrix,
+    food_types: pd.Index,
+    level: int,
+    metadata: pd.DataFrame,
+) -> pd.DataFrame:
+    """
+    Build the non-zero food counts at a single ontology level in long format.
+
+    Return:
+        A long format dataframe with columns: filename, food_type, count, level, group,
+        ordered like the rows of the dense table with the zero counts left out.
+    Args:
+        counts (sparse matrix): obtained using _get_level_counts().
+        food_types (index): food types of the columns of counts.
+        level (integer): indicates the level of the food ontology to use.
+        metadata (dataframe): study samples obtained using get_sample_metadata(), the rows of counts.
+    """
+    order = np.lexsort((counts.row, counts.col))
+    rows, cols = counts.row[order], counts.col[order]
+    return pd.DataFrame(
+        {
+            "filename": metadata["filename"].to_numpy()[rows],
+            "food_type": food_types.to_numpy()[cols],
+            "count": counts.data[order].astype(np.int64),
+            "level": level,
+            "group": metadata["group"].to_numpy()[rows],
+        }
+    )
+
+
+def _iter_network_chunks(
+    gnps_network: Union[str, pd.DataFrame], chunksize: int
+) -> Iterator[pd.DataFrame]:
+    """
+    Iterate over a GNPS molecular network, given as a path or a dataframe, in chunks of clusters.
+    """
+    if isinstance(gnps_network, pd.DataFrame):
+        for start in range(0, len(gnps_network), chunksize):
+            yield gnps_network.iloc[start : start + chunksize]
+    else:
+        yield from read_gnps_network(gnps_network, chunksize=chunksize)
+
+
+def _get_network_index(
+    gnps_network: Union[str, pd.DataFrame, NetworkIndex],
+) -> NetworkIndex:
+    """
+    Return: the index of a GNPS molecular network given as a path, a dataframe or its index.
+    """
+    if isinstance(gnps_network, NetworkIndex):
+        return gnps_network
+    if isinstance(gnps_network, pd.DataFrame):
+        return NetworkIndex(gnps_network)
+    return NetworkIndex(read_gnps_network(gnps_network))
+
+
+@profiled
+def _get_dataset_matches_batch(
+    gnps_network: Union[str, pd.DataFrame, NetworkIndex],
+    sample_types: pd.DataFrame,
+    group_configs: List[Tuple[List[str], List[str]]],
+    n_jobs: int = 1,
+    chunksize: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    progress: Optional[Callable[[int, int, Optional[float]], None]] = None,
+    cancel: Optional[CancellationToken] = None,
+) -> List[Tuple[pd.DataFrame, sparse.csr_matrix]]:
+    """
+    Count the reference matches of the study samples of a GNPS molecular network
+    for several group configurations.
+
+    The network is read and indexed once, and the group selections of all configurations
+    are computed from the same read of the groups.
+    In streaming mode the network is read twice in chunks of clusters, first to collect the
+    study samples and then to add up the reference matches of each chunk, so that memory
+    use does not grow with the size of the network. A network index is never streamed.
+    The chunks are counted serially, as starting worker processes for each chunk costs more
+    than it saves, so n_jobs is ignored in streaming mode.
+
+    The progress is reported after each batch of study files, or after each chunk in
+    streaming mode, and the cancellation token is checked at the same time. When the run
+    is cancelled, only the study samples whose matches are complete are returned,
+    which are none in streaming mode.
+
+    Return:
+        For each (all_groups, some_groups) configuration, the study samples obtained using
+        get_sample_metadata(), and the reference matches obtained using
+        _get_reference_matches() with the study samples as rows.
+    """
+    if chunksize is None or isinstance(gnps_network, NetworkIndex):
+        network_index = _get_network_index(gnps_network)
+        all_metadata = [
+            get_sample_metadata(network_index.gnps_network, all_groups)
+            for all_groups, _ in group_configs
+        ]
+        tracker = ProgressTracker(
+            sum(len(metadata) for metadata in all_metadata), progress, cancel
+        )
+        results = []
+        for metadata, (all_groups, some_groups) in zip(all_metadata, group_configs):
+            shards = []
+            if not tracker.cancelled:
+                for start, stop, shard in _iter_reference_matches(
+                    network_index,
+                    sample_types,
+                    all_groups,
+                    some_groups,
+                    metadata["filename"],
+                    n_jobs,
+                    batch_size,
+                ):
+                    shards.append(shard)
+                    tracker.update(int(stop - start))
+                    if tracker.cancelled:
+                        break
+            matches = _stack_matches(shards, len(sample_types))
+            results.append((metadata.iloc[: matches.shape[0]], matches))
+        return results
+    all_metadata = [[] for _ in group_configs]
+    n_clusters = 0
+    for chunk in _iter_network_chunks(gnps_network, chunksize):
+        n_clusters += len(chunk)
+        for metadata, (all_groups, _) in zip(all_metadata, group_configs):
+            metadata.append(get_sample_metadata(chunk, all_groups))
+    all_metadata = [
+        pd.concat(metadata).drop_duplicates().reset_index(drop=True)
+        for metadata in all_metadata
+    ]
+    all_matches = [
+        sparse.csr_matrix((len(metadata), len(sample_types)), dtype=np.int32)
+        for metadata in all_metadata
+    ]
+    # The progress of a streamed network is measured in clusters.
+    tracker = ProgressTracker(n_clusters, progress, cancel)
+    for chunk in _iter_network_chunks(gnps_network, chunksize):
+        if tracker.cancelled:
+            return [
+                (metadata.iloc[:0], matches[:0])
+                for metadata, matches in zip(all_metadata, all_matches)
+            ]
+        network_index = NetworkIndex(chunk)
+        for i, (all_groups, some_groups) in enumerate(group_configs):
+            all_matches[i] += _get_reference_matches(
+                network_index,
+                sample_types,
+                all_groups,
+                some_groups,
+                all_metadata[i]["filename"],
+            )
+        tracker.update(len(chunk))
+    return list(zip(all_metadata, all_matches))
+
+
+def _get_dataset_matches(
+    gnps_network: Union[str, pd.DataFrame, NetworkIndex],
+    sample_types: pd.DataFrame,
+    all_groups: List[str],
+    some_groups: List[str],
+    n_jobs: int = 1,
+    chunksize: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    progress: Optional[Callable[[int, int, Optional[float]], None]] = None,
+    cancel: Optional[CancellationToken] = None,
+) -> Tuple[pd.DataFrame, sparse.csr_matrix]:
+    """
+    Count the reference matches of the study samples of a GNPS molecular network.
+
+    Return:
+        The study samples obtained using get_sample_metadata(), and the reference matches
+        obtained using _get_reference_matches() with the study samples as rows.
+    """
+    return _get_dataset_matches_batch(
+        gnps_network,
+        sample_types,
+        [(all_groups, some_groups)],
+        n_jobs,
+        chunksize,
+        batch_size,
+        progress,
+        cancel,
+    )[0]
+
+
+def _get_batch_counts(
+    matches: sparse.csr_matrix, sample_types: pd.DataFrame, levels: int, start: int
+) -> pd.DataFrame:
+    """
+    Count the food matches of a batch of study files at all levels, to store in a checkpoint.
+
+    Return:
+        A dataframe with the level, the position of the study file (row),
+        the position of the food type in the sorted food types of the level (col),
+        and the count of each non-zero count.
+    Args:
+        matches (sparse matrix): reference matches of the batch of study files.
+        sample_types (dataframe): obtained using get_sample_types(), the columns of matches.
+        levels (integer): number of levels to calculate food counts for.
+        start (integer): position of the first study file of the batch.
+    """
+    batch_counts = []
+    for level, counts, _ in _iter_level_counts(matches, sample_types, levels):
+        batch_counts.append(
+            pd.DataFrame(
+                {
+                    "level": np.full(counts.nnz, level, dtype=np.int32),
+                    "row": counts.row.astype(np.int64) + start,
+                    "col": counts.col.astype(np.int64),
+                    "count": counts.data,
+                }
+            )
+        )
+    return pd.concat(batch_counts, ignore_index=True)
+
+
+def _iter_checkpoint_level_counts(
+    batch_counts: pd.DataFrame, n_files: int, sample_types: pd.DataFrame, levels: int
+) -> Iterator[Tuple[int, sparse.coo_matrix, pd.Index]]:
+    """
+    Return:
+        An iterator over the levels 0 to levels and their counts as obtained using
+        _iter_level_counts(), from the counts of the batches obtained using _get_batch_counts().
+    """
+    for level in range(levels + 1):
+        food_types = _get_food_types(sample_types, level)
+        level_counts = batch_counts[batch_counts["level"] == level]
+        counts = sparse.coo_matrix(
+            (
+                level_counts["count"].to_numpy(),
+                (level_counts["row"].to_numpy(), level_counts["col"].to_numpy()),
+            ),
+            shape=(n_files, len(food_types)),
+        )
+        yield level, counts, food_types
+
+
+@profiled
+def _get_checkpoint_level_counts(
+    gnps_network: Union[str, pd.DataFrame, NetworkIndex],
+    sample_types: pd.DataFrame,
+    all_groups: List[str],
+    some_groups: List[str],
+    levels: int,
+    checkpoint: Checkpoint,
+    n_jobs: int = 1,
+    batch_size: Optional[int] = None,
+    progress: Optional[Callable[[int, int, Optional[float]], None]] = None,
+    cancel: Optional[CancellationToken] = None,
+) -> Tuple[pd.DataFrame, Iterator[Tuple[int, sparse.coo_matrix, pd.Index]]]:
+    """
+    Count the food matches of the study samples at all levels in batches of study files,
+    storing each completed batch in the checkpoint and skipping the batches stored before.
+
+    Return:
+        The study samples obtained using get_sample_metadata(), and the counts of all levels
+        as obtained using _iter_level_counts(), of the study samples whose batch is complete.
+    """
+    network_index = _get_network_index(gnps_network)
+    metadata = get_sample_metadata(network_index.gnps_network, all_groups)
+    batches = checkpoint.get_batches()
+    tracker = ProgressTracker(
+        len(metadata),
+        progress,
+        cancel,
+        done=sum(stop - start for start, stop in batches.items()),
+    )
+    if not tracker.cancelled:
+        for start, stop, matches in _iter_reference_matches(
+            network_index,
+            sample_types,
+            all_groups,
+            some_groups,
+            metadata["filename"],
+            n_jobs,
+            batch_size,
+            skip=batches,
+        ):
+            checkpoint.save(
+                start, stop, _get_batch_counts(matches, sample_types, levels, start)
+            )
+            tracker.update(int(stop - start))
+            if tracker.cancelled:
+                break
+    if len(checkpoint.get_batches()) > 0:
+        batch_counts = checkpoint.load()
+    else:
+        batch_counts = _get_batch_counts(
+            sparse.csr_matrix((0, len(sample_types)), dtype=np.int32),
+            sample_types,
+            levels,
+            0,
+        )
+    return metadata, _iter_checkpoint_level_counts(
+        batch_counts, len(metadata), sample_types, levels
+    )
+
+
+def _hash_frame(df: pd.DataFrame) -> str:
+    """
+    Return: the SHA-256 hex digest of the contents of a dataframe.
+    """
+    sha256 = hashlib.sha256(str(list(df.columns)).encode("utf-8"))
+    sha256.update(pd.util.hash_pandas_object(df).to_numpy().tobytes())
+    return sha256.hexdigest()
+
+
+def _get_result_key(
+    function: str,
+    gnps_network: Union[str, pd.DataFrame, NetworkIndex],
+    sample_types: Union[str, pd.DataFrame],
+    all_groups: List[str],
+    some_groups: List[str],
+    **params,
+) -> str:
+    """
+    Return: the result cache key of a food counts table.
+    """
+    if isinstance(gnps_network, NetworkIndex):
+        gnps_network = gnps_network.gnps_network
+    if isinstance(gnps_network, pd.DataFrame):
+        gnps_network = _hash_frame(gnps_network[list(_NETWORK_DTYPES)])
+    else:
+        gnps_network = _hash_file_cached(gnps_network)
+    if isinstance(sample_types, pd.DataFrame):
+        sample_types = _hash_frame(sample_types)
+    return ResultCache.get_key(
+        function=function,
+        version=_FOOD_COUNTS_VERSION,
+        gnps_network=gnps_network,
+        ontology=[
+            _FOOD_ONTOLOGY_VERSION,
+            _hash_file_cached(_get_food_metadata_key()[0]),
+        ],
+        sample_types=sample_types,
+        all_groups=list(all_groups),
+        some_groups=list(some_groups),
+        **params,
+    )
+
+
+@profiled
+def _get_food_counts_all(
+    metadata: pd.DataFrame,
+    level_counts: Iterable[Tuple[int, sparse.coo_matrix, pd.Index]],
+    include_zeros: bool,
+) -> pd.DataFrame:
+    """
+    Build the food counts of all levels in long format.
+
+    Return:
+        A long format dataframe with columns: filename, food_type, level, count, group.
+    Args:
+        metadata (dataframe): study samples obtained using get_sample_metadata(), the rows of the counts.
+        level_counts (iterable): levels and their counts obtained using _iter_level_counts().
+        include_zeros (boolean): whether to include the zero counts of each sample's level.
+    """
+    all_data = []
+    for level, counts, food_types in level_counts:
+        if not include_zeros:
+            all_data.append(
+                _get_level_food_counts_long(counts, food_types, level, metadata)
+            )
+            continue
+        food_counts = _get_level_food_counts(
+            counts, food_types, level, metadata["filename"]
+        )
+        with stage("melt", len(food_counts)) as melt_stage:
+            food_counts_long = food_counts.reset_index().melt(
+                id_vars="filename", var_name="food_type", value_name="count"
+            )
+            food_counts_long["level"] = level
+            melt_stage.rows_out = len(food_counts_long)
+        # Empty levels are left out, their empty tables would change the column types.
+        if len(food_counts_long) > 0:
+            all_data.append(food_counts_long)
+
+    with stage("concat", sum(len(data) for data in all_data)) as concat_stage:
+        if include_zeros and len(all_data) == 0:
+            all_data.append(
+                pd.DataFrame(
+                    {
+                        "filename": pd.Series(dtype=str),
+                        "food_type": pd.Series(dtype=str),
+                        "count": pd.Series(dtype=np.int64),
+                        "level": pd.Series(dtype=np.int64),
+                    }
+                )
+            )
+        result_df = pd.concat(all_data, ignore_index=True)
+        if include_zeros:
+            result_df["count"] = result_df["count"].astype(np.int64)
+            result_df["group"] = (
+                result_df["filename"]
+                .map(metadata.set_index("filename")["group"])
+                .astype(metadata["group"].dtype)
+            )
+        else:
+            result_df = result_df.astype(
+                {"filename": "category", "food_type": "category", "group": "category"}
+            )
+        concat_stage.rows_out = len(result_df)
+    return result_df
+
+
+@profiled
 def get_dataset_food_counts(
-    gnps_network: str,
-    sample_types: str,
+    gnps_network: Union[str, pd.DataFrame, NetworkIndex],
+    sample_types: Union[str, pd.DataFrame],
     all_groups: List[str],
     some_groups: List[str],
     level: int,
+    n_jobs: int = 1,
+    chunksize: Optional[int] = None,
+    cache: Optional[ResultCache] = None,
+    batch_size: Optional[int] = None,
+    progress: Optional[Callable[[int, int, Optional[float]], None]] = None,
+    cancel: Optional[CancellationToken] = None,
 ) -> pd.DataFrame:
     """
     Generate a table of food counts for a study dataset.
@@ -144,14 +1418,30 @@ def get_dataset_food_counts(
     Args:
         gnps_network (string): path to tsv file generated from classical molecular.
                                networking with study dataset(s) and reference dataset.
+                               Can also be the network already read using read_gnps_network(),
+                               or its NetworkIndex, to reuse it across calls.
         sample_types (string): one of 'simple', 'complex', or 'all'.
                                Simple foods are single ingredients while complex foods contain multiple ingredients.
                                'all' will return both simple and complex foods.
+                               Can also be a dataframe obtained using get_sample_types().
         all_groups (list): can contain 'G1', 'G2' to denote study spectrum files.
         some_groups (list): can contain 'G3', 'G4' to denote reference spectrum files.
         level (integer): indicates the level of the food ontology to use.
                          One of 1, 2, 3, 4, 5, 6, or 0.
                          0 will return counts for individual reference spectrum files, rather than food categories.
+        n_jobs (integer): number of worker processes to count the study files in, -1 to use all processors.
+        chunksize (integer): if given, stream the network in chunks of this many clusters
+                             to bound memory use on networks that do not fit in memory.
+                             The chunks are counted serially, n_jobs is ignored.
+        cache (ResultCache): if given, return the cached result of a previous identical call,
+                             or store the result for the next one.
+        batch_size (integer): if given, count the study files in batches of this many files.
+        progress (function): if given, called as progress(done, total, eta) after each batch
+                             of study files, or each chunk of clusters when streaming,
+                             with eta the estimated number of seconds left.
+        cancel (CancellationToken): if given, checked after each batch. When it is cancelled,
+                                    the counts of the study files completed so far are returned,
+                                    none when streaming, and the result is not cached.
     Return:
         A data frame
     Examples:
@@ -161,61 +1451,440 @@ def get_dataset_food_counts(
                                 some_groups = ['G4'],
                                 level = 5)
     """
-    food_counts, filenames = [], []
-    gnps_network = pd.read_csv(gnps_network, sep="\t")
-    sample_types = get_sample_types(sample_types)
-    metadata = get_sample_metadata(gnps_network, all_groups)
-    for filename in metadata["filename"]:
-        file_food_counts = get_file_food_counts(
-            gnps_network, sample_types, all_groups, some_groups, [filename], level
-        )
-        if len(file_food_counts) > 0:
-            food_counts.append(file_food_counts)
-            filenames.append(filename)
-    food_counts = pd.concat(food_counts, axis=1, sort=True).fillna(0).astype(int).T
-    food_counts.index = pd.Index(filenames, name="filename")
+    if cache is not None:
+        key = _get_result_key(
+            "get_dataset_food_counts",
+            gnps_network,
+            sample_types,
+            all_groups,
+            some_groups,
+            level=level,
+        )
+        food_counts = cache.load(key)
+        if food_counts is not None:
+            return food_counts
+    if not isinstance(sample_types, pd.DataFrame):
+        sample_types = get_sample_types(sample_types)
+    metadata, matches = _get_dataset_matches(
+        gnps_network,
+        sample_types,
+        all_groups,
+        some_groups,
+        n_jobs,
+        chunksize,
+        batch_size,
+        progress,
+        cancel,
+    )
+    counts, food_types = _get_level_counts(matches, sample_types, level)
+    food_counts = _get_level_food_counts(
+        counts, food_types, level, metadata["filename"]
+    )
+    if cache is not None and not (cancel is not None and cancel.cancelled):
+        cache.save(key, food_counts)
     return food_counts
 
 
+@profiled
 def get_dataset_food_counts_all(
-    gnps_network: str,
-    sample_types: str,
+    gnps_network: Union[str, pd.DataFrame, NetworkIndex],
+    sample_types: Union[str, pd.DataFrame],
     all_groups: List[str],
     some_groups: List[str],
     levels: int = 6,
+    n_jobs: int = 1,
+    chunksize: Optional[int] = None,
+    cache: Optional[ResultCache] = None,
+    include_zeros: bool = True,
+    batch_size: Optional[int] = None,
+    progress: Optional[Callable[[int, int, Optional[float]], None]] = None,
+    cancel: Optional[CancellationToken] = None,
+    checkpoint_dir: Optional[str] = None,
 ) -> pd.DataFrame:
     """
     Generate a table of food counts for a study dataset for all levels at once in long format.
+    The network is read and matched to the reference samples once for all levels,
+    after which every level only costs a sparse matrix product.
 
     Args:
         gnps_network (string): Path to tsv file generated from classical molecular networking
                                with study dataset(s) and reference dataset.
+                               Can also be the network already read using read_gnps_network(),
+                               or its NetworkIndex, to reuse it across calls.
         sample_types (string): One of 'simple', 'complex', or 'all'.
                                Simple foods are single ingredients while complex foods contain multiple ingredients.
                                'all' will return both simple and complex foods.
+                               Can also be a dataframe obtained using get_sample_types().
         all_groups (list): List of study spectrum file groups.
         some_groups (list): List of reference spectrum file groups.
         levels (integer): Number of levels to calculate food counts for.
+        n_jobs (integer): Number of worker processes to count the study files in, -1 to use all processors.
+        chunksize (integer): If given, stream the network in chunks of this many clusters
+                             to bound memory use on networks that do not fit in memory.
+                             The chunks are counted serially, n_jobs is ignored.
+        cache (ResultCache): If given, return the cached result of a previous identical call,
+                             or store the result for the next one.
+        include_zeros (boolean): Whether to include the zero counts of each sample's level.
+                                 Otherwise only non-zero counts are returned, built directly from
+                                 the sparse counts with categorical filename, food_type and group,
+                                 which is much smaller for large studies.
+        batch_size (integer): If given, count the study files in batches of this many files.
+        progress (function): If given, called as progress(done, total, eta) after each batch
+                             of study files, or each chunk of clusters when streaming,
+                             with eta the estimated number of seconds left.
+        cancel (CancellationToken): If given, checked after each batch. When it is cancelled,
+                                    the counts of the study files completed so far are returned,
+                                    none when streaming, and the result is not cached.
+        checkpoint_dir (string): If given, store the counts of each completed batch of study files
+                                 in a checkpoint in this directory, so that a call with the same
+                                 network, sample types, groups, levels and batch size resumes from
+                                 the completed batches. The batch size defaults to 1000 files.
+                                 Requires pyarrow or fastparquet, and cannot be used with chunksize.
     Return:
         A long format dataframe with columns: filename, food_type, level, count, group.
     """
-    gnps_network_df = pd.read_csv(gnps_network, sep="\t")
-    metadata = get_sample_metadata(gnps_network_df, all_groups)
+    if cache is not None:
+        key = _get_result_key(
+            "get_dataset_food_counts_all",
+            gnps_network,
+            sample_types,
+            all_groups,
+            some_groups,
+            levels=levels,
+            include_zeros=include_zeros,
+        )
+        result_df = cache.load(key)
+        if result_df is not None:
+            return result_df
+    if checkpoint_dir is not None:
+        if chunksize is not None:
+            raise ValueError("A streamed network cannot be checkpointed")
+        batch_size = _CHECKPOINT_BATCH_SIZE if batch_size is None else batch_size
+        checkpoint = Checkpoint(
+            os.path.join(
+                checkpoint_dir,
+                _get_result_key(
+                    "checkpoint",
+                    gnps_network,
+                    sample_types,
+                    all_groups,
+                    some_groups,
+                    levels=levels,
+                    batch_size=batch_size,
+                ),
+            )
+        )
+    if not isinstance(sample_types, pd.DataFrame):
+        sample_types = get_sample_types(sample_types)
+    if checkpoint_dir is not None:
+        metadata, level_counts = _get_checkpoint_level_counts(
+            gnps_network,
+            sample_types,
+            all_groups,
+            some_groups,
+            levels,
+            checkpoint,
+            n_jobs,
+            batch_size,
+            progress,
+            cancel,
+        )
+    else:
+        metadata, matches = _get_dataset_matches(
+            gnps_network,
+            sample_types,
+            all_groups,
+            some_groups,
+            n_jobs,
+            chunksize,
+            batch_size,
+            progress,
+            cancel,
+        )
+        level_counts = _iter_level_counts(matches, sample_types, levels)
+    result_df = _get_food_counts_all(metadata, level_counts, include_zeros)
+    if cache is not None and not (cancel is not None and cancel.cancelled):
+        cache.save(key, result_df)
+
+    return result_df
+
+
+@profiled
+def get_dataset_food_counts_batch(
+    gnps_network: Union[str, pd.DataFrame, NetworkIndex],
+    sample_types: Union[str, pd.DataFrame],
+    group_configs: List[Tuple[List[str], List[str]]],
+    levels: int = 6,
+    n_jobs: int = 1,
+    chunksize: Optional[int] = None,
+    cache: Optional[ResultCache] = None,
+    include_zeros: bool = True,
+    batch_size: Optional[int] = None,
+    progress: Optional[Callable[[int, int, Optional[float]], None]] = None,
+    cancel: Optional[CancellationToken] = None,
+) -> Dict[Tuple[Tuple[str, ...], Tuple[str, ...]], pd.DataFrame]:
+    """
+    Generate the food counts tables of get_dataset_food_counts_all() for several group
+    configurations of the same study dataset at once.
+    The network is read and indexed once, and the group selections of all configurations
+    are computed from a single read of the G1 to G6 columns.
 
-    all_data = []
-    for level in range(levels + 1):
-        food_counts = get_dataset_food_counts(
-            gnps_network, sample_types, all_groups, some_groups, level
+    Args:
+        gnps_network (string): Path to tsv file generated from classical molecular networking
+                               with study dataset(s) and reference dataset.
+                               Can also be the network already read using read_gnps_network(),
+                               or its NetworkIndex, to reuse it across calls.
+        sample_types (string): One of 'simple', 'complex', or 'all'.
+                               Can also be a dataframe obtained using get_sample_types().
+        group_configs (list): (all_groups, some_groups) pairs of study and reference
+                              spectrum file groups, e.g. [(['G1'], ['G4']), (['G1', 'G2'], ['G3', 'G4'])].
+        levels (integer): Number of levels to calculate food counts for.
+        n_jobs (integer): Number of worker processes to count the study files in, -1 to use all processors.
+        chunksize (integer): If given, stream the network in chunks of this many clusters
+                             to bound memory use on networks that do not fit in memory.
+                             The chunks are counted serially, n_jobs is ignored.
+        cache (ResultCache): If given, reuse the cached results of previous identical calls,
+                             also those of get_dataset_food_counts_all(), and store the others.
+        include_zeros (boolean): Whether to include the zero counts of each sample's level.
+        batch_size (integer): If given, count the study files in batches of this many files.
+        progress (function): If given, called as progress(done, total, eta) after each batch
+                             of study files of any configuration, or each chunk of clusters
+                             when streaming, with eta the estimated number of seconds left.
+        cancel (CancellationToken): If given, checked after each batch. When it is cancelled,
+                                    the counts of the study files completed so far are returned,
+                                    none when streaming, and the results are not cached.
+    Return:
+        A dictionary from each (all_groups, some_groups) configuration, as tuples, to its
+        long format dataframe with columns: filename, food_type, level, count, group.
+    Examples:
+        get_dataset_food_counts_batch(gnps_network = 'METABOLOMICS-SNETS-V2-07f85565-view_all_clusters_withID_beta-main.tsv',
+                                      sample_types = 'simple',
+                                      group_configs = [(['G1'], ['G4']), (['G2'], ['G4'])])
+    """
+    configs = {}
+    for all_groups, some_groups in group_configs:
+        configs[tuple(all_groups), tuple(some_groups)] = None
+    if cache is not None:
+        keys = {
+            config: _get_result_key(
+                "get_dataset_food_counts_all",
+                gnps_network,
+                sample_types,
+                *config,
+                levels=levels,
+                include_zeros=include_zeros,
+            )
+            for config in configs
+        }
+        for config in configs:
+            configs[config] = cache.load(keys[config])
+    missing = [config for config, result_df in configs.items() if result_df is None]
+    if len(missing) > 0:
+        if not isinstance(sample_types, pd.DataFrame):
+            sample_types = get_sample_types(sample_types)
+        all_matches = _get_dataset_matches_batch(
+            gnps_network,
+            sample_types,
+            [
+                (list(all_groups), list(some_groups))
+                for all_groups, some_groups in missing
+            ],
+            n_jobs,
+            chunksize,
+            batch_size,
+            progress,
+            cancel,
         )
-        food_counts_long = food_counts.reset_index().melt(
-            id_vars="filename", var_name="food_type", value_name="count"
+        for config, (metadata, matches) in zip(missing, all_matches):
+            configs[config] = _get_food_counts_all(
+                metadata,
+                _iter_level_counts(matches, sample_types, levels),
+                include_zeros,
+            )
+            if cache is not None and not (cancel is not None and cancel.cancelled):
+                cache.save(keys[config], configs[config])
+    return configs
+
+
+def _get_file_fingerprints(
+    network_index: NetworkIndex,
+    sample_types: pd.DataFrame,
+    all_groups: List[str],
+    some_groups: List[str],
+    filenames: pd.Series,
+) -> np.ndarray:
+    """
+    Fingerprint the clusters that contribute to the food counts of each study file.
+
+    The food counts of a study file only depend on the reference files of the selected
+    clusters it is part of. Each cluster is hashed by the multiset of its reference files,
+    and the fingerprint of a study file is the sum of the hashes of its clusters, counted
+    as often as they occur, so it changes whenever its counts can change.
+
+    Return: the fingerprint of each study file, as a hexadecimal string of two 64-bit hashes.
+    """
+    selected = network_index.select_groups(all_groups, some_groups).positions
+    incidence = network_index.incidence[selected]
+    references = network_index.filenames.isin(sample_types.index)
+    weights = network_index.weights[selected].astype(np.uint64)
+    study = (incidence @ network_index.select_files(filenames) > 0).T.tocsr()
+    fingerprints = [
+        _sum_hashes(study, cluster_hashes * weights)
+        for cluster_hashes in _hash_clusters(
+            incidence, network_index.filenames, references
         )
-        food_counts_long["level"] = level
-        all_data.append(food_counts_long)
+    ]
+    return np.array([f"{a:016x}{b:016x}" for a, b in zip(*fingerprints)], dtype=object)
 
-    result_df = pd.concat(all_data, ignore_index=True)
-    result_df["group"] = result_df["filename"].map(
-        metadata.set_index("filename")["group"]
+
+@profiled
+def get_file_fingerprints(
+    gnps_network: Union[str, pd.DataFrame, NetworkIndex],
+    sample_types: Union[str, pd.DataFrame],
+    all_groups: List[str],
+    some_groups: List[str],
+) -> pd.Series:
+    """
+    Fingerprint the clusters that contribute to the food counts of each study file, to pass
+    to update_dataset_food_counts_all() when the network is updated.
+
+    Args:
+        gnps_network (string): Path to tsv file generated from classical molecular networking
+                               with study dataset(s) and reference dataset.
+                               Can also be the network already read using read_gnps_network(),
+                               or its NetworkIndex.
+        sample_types (string): One of 'simple', 'complex', or 'all'.
+                               Can also be a dataframe obtained using get_sample_types().
+        all_groups (list): List of study spectrum file groups.
+        some_groups (list): List of reference spectrum file groups.
+    Return:
+        A series with the fingerprint of each study file, indexed by filename.
+    """
+    if not isinstance(sample_types, pd.DataFrame):
+        sample_types = get_sample_types(sample_types)
+    network_index = _get_network_index(gnps_network)
+    filenames = get_sample_metadata(network_index.gnps_network, all_groups)["filename"]
+    return pd.Series(
+        _get_file_fingerprints(
+            network_index, sample_types, all_groups, some_groups, filenames
+        ),
+        index=pd.Index(filenames, name="filename"),
+        name="fingerprint",
     )
 
-    return result_df
+
+@profiled
+def update_dataset_food_counts_all(
+    gnps_network: Union[str, pd.DataFrame, NetworkIndex],
+    sample_types: Union[str, pd.DataFrame],
+    all_groups: List[str],
+    some_groups: List[str],
+    previous: pd.DataFrame,
+    previous_fingerprints: pd.Series,
+    levels: int = 6,
+    n_jobs: int = 1,
+    include_zeros: bool = True,
+) -> Tuple[pd.DataFrame, pd.Series]:
+    """
+    Update the food counts of get_dataset_food_counts_all() for a new version of a network,
+    such as after adding study files, only counting the study files whose contributing
+    clusters changed.
+
+    The study files are compared by the fingerprints of their contributing clusters.
+    The food counts of the study files with the same fingerprint are taken from the previous
+    result, the others are counted again, and the study files no longer in the network are
+    dropped. The result is the same as that of get_dataset_food_counts_all() on the new network,
+    provided the previous result was computed with the same sample types, groups and levels
+    and the same food ontology.
+
+    Args:
+        gnps_network (string): Path to tsv file of the new network generated from classical
+                               molecular networking with study dataset(s) and reference dataset.
+                               Can also be the network already read using read_gnps_network(),
+                               or its NetworkIndex.
+        sample_types (string): One of 'simple', 'complex', or 'all'.
+                               Can also be a dataframe obtained using get_sample_types().
+        all_groups (list): List of study spectrum file groups.
+        some_groups (list): List of reference spectrum file groups.
+        previous (dataframe): food counts of the previous network obtained using
+                              get_dataset_food_counts_all() or update_dataset_food_counts_all().
+        previous_fingerprints (series): fingerprints of the previous network obtained using
+                                        get_file_fingerprints() or update_dataset_food_counts_all().
+        levels (integer): Number of levels to calculate food counts for.
+        n_jobs (integer): Number of worker processes to count the study files in, -1 to use all processors.
+        include_zeros (boolean): Whether to include the zero counts of each sample's level.
+    Return:
+        The long format dataframe of food counts of the new network with columns:
+        filename, food_type, level, count, group, and the fingerprints of the new network.
+    Examples:
+        f_counts, fingerprints = update_dataset_food_counts_all(gnps_network = 'new_network.tsv',
+                                                                sample_types = 'simple',
+                                                                all_groups = ['G1'],
+                                                                some_groups = ['G4'],
+                                                                previous = f_counts,
+                                                                previous_fingerprints = fingerprints)
+    """
+    if not isinstance(sample_types, pd.DataFrame):
+        sample_types = get_sample_types(sample_types)
+    network_index = _get_network_index(gnps_network)
+    metadata = get_sample_metadata(network_index.gnps_network, all_groups)
+    filenames = pd.Index(metadata["filename"], name="filename")
+    fingerprints = pd.Series(
+        _get_file_fingerprints(
+            network_index, sample_types, all_groups, some_groups, metadata["filename"]
+        ),
+        index=filenames,
+        name="fingerprint",
+    )
+    unchanged = fingerprints.to_numpy() == previous_fingerprints.reindex(
+        filenames
+    ).to_numpy(dtype=object)
+    # Locate the previous non-zero counts of the study files in the new food counts.
+    previous = previous[previous["count"] > 0]
+    previous_rows = filenames.get_indexer(previous["filename"])
+    previous_cols = np.full(len(previous), -1)
+    all_food_types = [
+        _get_food_types(sample_types, level) for level in range(levels + 1)
+    ]
+    for level, food_types in enumerate(all_food_types):
+        in_level = (previous["level"] == level).to_numpy()
+        previous_cols[in_level] = food_types.get_indexer(
+            np.asarray(previous["food_type"])[in_level]
+        )
+    # Count study files again whose previous food types are not in the ontology anymore.
+    unknown = (previous_rows >= 0) & (previous_cols < 0)
+    unchanged[previous_rows[unknown]] = False
+    reused = (previous_rows >= 0) & unchanged[previous_rows]
+    changed = np.flatnonzero(~unchanged)
+    matches = _get_reference_matches(
+        network_index,
+        sample_types,
+        all_groups,
+        some_groups,
+        metadata["filename"].iloc[changed],
+        n_jobs,
+    )
+
+    def iter_level_counts():
+        previous_levels = previous["level"].to_numpy()
+        for level, counts, food_types in _iter_level_counts(
+            matches, sample_types, levels
+        ):
+            in_level = reused & (previous_levels == level)
+            yield level, sparse.coo_matrix(
+                (
+                    np.concatenate(
+                        [counts.data, previous["count"].to_numpy()[in_level]]
+                    ),
+                    (
+                        np.concatenate([changed[counts.row], previous_rows[in_level]]),
+                        np.concatenate([counts.col, previous_cols[in_level]]),
+                    ),
+                ),
+                shape=(len(metadata), len(food_types)),
+            ), food_types
+
+    return (
+        _get_food_counts_all(metadata, iter_level_counts(), include_zeros),
+        fingerprints,
+    )
@@ -0,0 +1,180 @@
+import contextlib
+import contextvars
+import functools
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+class Stage:
+    """
+    Measurements of one stage of a food counts run, see Profiler.
+
+    Attributes:
+        name (string): name of the stage, such as the function it times.
+        depth (integer): number of stages the stage is nested in.
+        seconds (float): wall time of the stage.
+        rows_in (integer): number of rows the stage received, if known.
+        rows_out (integer): number of rows the stage produced, if known.
+        peak_memory (integer): peak memory allocated during the stage in bytes, above the
+                               memory allocated when it started, if memory is traced.
+    """
+
+    def __init__(self, name: str, depth: int, rows_in: Optional[int] = None):
+        self.name = name
+        self.depth = depth
+        self.seconds = None
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.peak_memory = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return: the measurements of the stage as a JSON-serializable dictionary.
+        """
+        return {
+            "stage": self.name,
+            "depth": self.depth,
+            "seconds": self.seconds,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "peak_memory": self.peak_memory,
+        }
+
+
+class Profiler:
+    """
+    Record the wall time, rows in and out, and peak memory of each stage of the food counts
+    computed while the profiler is active, such as reading the network, loading the food
+    metadata, selecting the groups, matching the files and assembling the tables.
+
+    Stages nested in another stage, such as get_sample_types() within get_dataset_food_counts(),
+    are recorded with a higher depth. Tracing the memory slows the run down, it can be disabled.
+    Stages computed in worker processes are not recorded.
+
+    Args:
+        callback (function): if given, called with the dictionary of each stage when it ends.
+        trace_memory (boolean): whether to record the peak memory of each stage using tracemalloc.
+    Examples:
+        with Profiler() as profiler:
+            get_dataset_food_counts_all(gnps_network = 'METABOLOMICS-SNETS-V2-07f85565-view_all_clusters_withID_beta-main.tsv',
+                                        sample_types = 'simple',
+                                        all_groups = ['G1'],
+                                        some_groups = ['G4'])
+        profiler.to_json('profile.json')
+    """
+
+    def __init__(
+        self,
+        callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        trace_memory: bool = True,
+    ):
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.stages: List[Stage] = []
+        self.seconds = None
+        self._open_stages: List[Stage] = []
+        self._peaks: List[int] = []
+
+    def __enter__(self) -> "Profiler":
+        self._token = _active_profiler.set(self)
+        self._started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.seconds = time.perf_counter() - self._start
+        if self._started_tracing:
+            tracemalloc.stop()
+        _active_profiler.reset(self._token)
+
+    @contextlib.contextmanager
+    def _stage(self, name: str, rows_in: Optional[int]) -> Iterator[Stage]:
+        stage = Stage(name, len(self._open_stages), rows_in)
+        # Stages are recorded in the order they start.
+        self.stages.append(stage)
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            # Keep the peak of the enclosing stage before the peak is reset for this one.
+            current, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self._peaks.append(current)
+        self._open_stages.append(stage)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds = time.perf_counter() - start
+            self._open_stages.pop()
+            if tracing:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                stage.peak_memory = peak - current
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+            if self.callback is not None:
+                self.callback(stage.to_dict())
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Return: a JSON-serializable dictionary with the total wall time and the stages of the run.
+        """
+        return {
+            "seconds": self.seconds,
+            "stages": [stage.to_dict() for stage in self.stages],
+        }
+
+    def to_json(self, path: Optional[str] = None) -> str:
+        """
+        Return: the report of the run as JSON, which is also written to path if given.
+        """
+        report = json.dumps(self.report(), indent=2)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(report)
+        return report
+
+
+# Profiler of the current run, if any.
+_active_profiler: contextvars.ContextVar = contextvars.ContextVar(
+    "gfop_profiler", default=None
+)
+
+
+@contextlib.contextmanager
+def stage(name: str, rows_in: Optional[int] = None) -> Iterator[Stage]:
+    """
+    Record a stage of the food counts with the active profiler, if any.
+    The rows_out of the yielded stage can be set before the stage ends.
+    """
+    profiler = _active_profiler.get()
+    if profiler is None:
+        yield Stage(name, 0, rows_in)
+        return
+    with profiler._stage(name, rows_in) as profiled_stage:
+        yield profiled_stage
+
+
+def profiled(function: Callable) -> Callable:
+    """
+    Record each call of a function as a stage with the active profiler, if any.
+    The rows in and out are the number of rows of the first argument and of the result,
+    when they are tables or matrices.
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _active_profiler.get() is None:
+            return function(*args, **kwargs)
+        rows_in = args[0].shape[0] if args and hasattr(args[0], "shape") else None
+        with stage(function.__name__, rows_in) as profiled_stage:
+            result = function(*args, **kwargs)
+            if hasattr(result, "shape"):
+                profiled_stage.rows_out = result.shape[0]
+        return result
+
+    return wrapper
@@ -0,0 +1,78 @@
+import threading
+import time
+from typing import Callable, Optional
+
+
+class CancellationToken:
+    """
+    Token to stop a food counts run cooperatively, for example from another thread when a
+    deadline passes. The run checks the token between batches of study files and returns the
+    food counts of the study files completed so far.
+
+    Examples:
+        cancel = CancellationToken()
+        threading.Timer(3600, cancel.cancel).start()
+        get_dataset_food_counts_all(gnps_network = 'METABOLOMICS-SNETS-V2-07f85565-view_all_clusters_withID_beta-main.tsv',
+                                    sample_types = 'simple',
+                                    all_groups = ['G1'],
+                                    some_groups = ['G4'],
+                                    batch_size = 100,
+                                    cancel = cancel)
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        """
+        Request the run to stop after the current batch.
+        """
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+class ProgressTracker:
+    """
+    Track the progress of a food counts run, report it and check for cancellation.
+
+    Args:
+        total (integer): number of units of work of the run, such as study files.
+        progress (function): if given, called as progress(done, total, eta) after each batch,
+                             with eta the estimated number of seconds left, or None before
+                             any work is done.
+        cancel (CancellationToken): if given, the run stops when it is cancelled.
+        done (integer): number of units of work already finished, such as those of a
+                        resumed run, which do not count towards the estimated time left.
+    """
+
+    def __init__(
+        self,
+        total: int,
+        progress: Optional[Callable[[int, int, Optional[float]], None]] = None,
+        cancel: Optional[CancellationToken] = None,
+        done: int = 0,
+    ):
+        self.total = total
+        self.done = done
+        self._initial_done = done
+        self.progress = progress
+        self.cancel = cancel
+        self._start = time.perf_counter()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel is not None and self.cancel.cancelled
+
+    def update(self, done: int) -> None:
+        """
+        Record that done more units of work are finished and report the progress.
+        """
+        self.done += done
+        if self.progress is not None:
+            elapsed = time.perf_counter() - self._start
+            finished = self.done - self._initial_done
+            eta = elapsed / finished * (self.total - self.done) if finished else None
+            self.progress(self.done, self.total, eta)
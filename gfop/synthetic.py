@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+from gfop.get_food_counts import _GROUPS, get_sample_types
+
+
+def make_gnps_network(
+    n_clusters: int = 1000,
+    n_study_files: int = 100,
+    n_reference_files: int = 500,
+    files_per_cluster: float = 5,
+    study_fraction: float = 0.5,
+    study_groups: Sequence[str] = ("G1",),
+    reference_groups: Sequence[str] = ("G4",),
+    water_fraction: float = 0.01,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Generate a synthetic GNPS molecular network to measure the performance of the food counts
+    without a real GNPS job.
+
+    The reference files are real filenames sampled from the Global FoodOmics ontology,
+    so that they match its food types, while the study files are named study_<number>.mzXML.
+    Each cluster contains a random number of files, each of which is a study file with
+    probability study_fraction and a reference file otherwise.
+    Study and reference files are assigned to their groups in turn.
+
+    Return:
+        A dataframe with the cluster index, DefaultGroups, UniqueFileSources and G1 to G6
+        columns of a network generated from classical molecular networking,
+        which can be saved with to_csv(path, sep='\\t', index=False).
+    Args:
+        n_clusters (integer): number of clusters.
+        n_study_files (integer): number of study spectrum files.
+        n_reference_files (integer): number of reference spectrum files.
+        files_per_cluster (float): average number of files per cluster, at least 1.
+        study_fraction (float): probability of each file of a cluster to be a study file.
+        study_groups (list): groups of the study spectrum files, e.g. ['G1', 'G2'].
+        reference_groups (list): groups of the reference spectrum files, e.g. ['G4'].
+        water_fraction (float): fraction of the reference files that are water (blank) references.
+        seed (integer): seed of the random number generator.
+    Examples:
+        make_gnps_network(n_clusters = 100000,
+                          n_study_files = 1000,
+                          n_reference_files = 3000).to_csv('network.tsv', sep = '\\t', index = False)
+    """
+    rng = np.random.default_rng(seed)
+    # Sample the reference files from the ontology, water (blank) references separately.
+    sample_types = get_sample_types("all")
+    is_water = (sample_types["sample_type_group1"] == "water").to_numpy()
+    n_water = int(round(water_fraction * n_reference_files))
+    water_files = sample_types.index[is_water]
+    food_files = sample_types.index[~is_water]
+    if n_water > len(water_files) or n_reference_files - n_water > len(food_files):
+        raise ValueError(
+            f"The ontology has {len(water_files)} water and {len(food_files)} other "
+            f"reference files, {n_water} and {n_reference_files - n_water} were requested"
+        )
+    reference_files = np.concatenate(
+        [
+            rng.choice(water_files.to_numpy(), n_water, replace=False),
+            rng.choice(
+                food_files.to_numpy(), n_reference_files - n_water, replace=False
+            ),
+        ]
+    )
+    study_files = np.array([f"study_{i:06d}.mzXML" for i in range(n_study_files)])
+    filenames = np.concatenate([study_files, reference_files])
+    file_groups = np.concatenate(
+        [
+            np.resize([_GROUPS.index(group) for group in study_groups], n_study_files),
+            np.resize(
+                [_GROUPS.index(group) for group in reference_groups],
+                n_reference_files,
+            ),
+        ]
+    )
+    # Draw the files of each cluster, files drawn twice are only counted once.
+    sizes = 1 + rng.poisson(files_per_cluster - 1, n_clusters)
+    clusters = np.repeat(np.arange(n_clusters), sizes)
+    is_study = rng.random(len(clusters)) < study_fraction
+    files = np.where(
+        is_study,
+        rng.integers(n_study_files, size=len(clusters)),
+        n_study_files + rng.integers(n_reference_files, size=len(clusters)),
+    )
+    cluster_files = (
+        pd.DataFrame({"cluster": clusters, "file": files})
+        .drop_duplicates()
+        .sort_values("cluster", kind="stable")
+    )
+    clusters = cluster_files["cluster"].to_numpy()
+    files = cluster_files["file"].to_numpy()
+    # Count the files of each group in each cluster.
+    group_counts = np.bincount(
+        clusters * len(_GROUPS) + file_groups[files],
+        minlength=n_clusters * len(_GROUPS),
+    ).reshape(n_clusters, len(_GROUPS))
+    default_groups = pd.Series("", index=range(n_clusters))
+    for i, group in enumerate(_GROUPS):
+        default_groups += np.where(group_counts[:, i] > 0, f"{group},", "")
+    gnps_network = pd.DataFrame(
+        {
+            "cluster index": np.arange(1, n_clusters + 1),
+            "DefaultGroups": default_groups.str.rstrip(","),
+            "UniqueFileSources": pd.Series(filenames[files])
+            .groupby(clusters)
+            .agg("|".join)
+            .to_numpy(),
+        }
+    )
+    for i, group in enumerate(_GROUPS):
+        gnps_network[group] = group_counts[:, i]
+    return gnps_network
@@ -12,14 +12,15 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/ka-west/gfop",
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=["benchmarks"]),
     classifiers=[
         "Development Status :: 1 - Planning",
         "Intended Audience :: Science/Research",
         "Programming Language :: Python :: 3",
         "Operating System :: OS Independent",
     ],
-    python_requires=">=3.6",
+    python_requires=">=3.9",
     include_package_data=True,
-    package_data={"": ["data/*.txt"]},
+    package_data={"": ["data/*.txt", "data/*.npz"]},
+    entry_points={"console_scripts": ["gfop = gfop.cli:main"]},
 )